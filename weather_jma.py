@@ -9,6 +9,8 @@ import csv
 import json
 import os
 import calendar
+import queue
+import threading
 
 import util.c2j_util    as cj
 import util.print_color as pc   ## replace with print_no_color if you don't need a colorful report
@@ -137,6 +139,8 @@ class ColInfo:
 
 #######################################################################
 ## Main Module
+PIPE_DEPTH = 1  # years buffered between the parser, encoder and writer stages
+
 def jma_main(csv_name):
     # Metadata in the output JSON file
     loc_df, yrs_df = cj.get_loc_year_csv(csv_name)
@@ -161,23 +165,17 @@ def jma_main(csv_name):
             s += CI.name[cx]
         return s
 
-    def WriteListJson(item_name, data_lst, date_fr, date_to):
-        fn_json = cj.get_fullpath_json(loc_df, item_name, date_fr[:4])
-        # Create a temp file to remove all the quotation characters in the JSON file
-        ''' Unwanted quotation marks added when json.dump was called.
-        Since I couldn't find easy way to prevent this behavior, added a post process after dumping.
-        Dump a temporary Json file and then apply some filters.  '''
-        fn_tmp = fn_json + '.temp'
-        try:
-            with open(fn_tmp, 'w') as tf:  # specify separators to remove spaces
-                json.dump(data_lst, tf, ensure_ascii=False, separators=(',', ':'))
-            with open(fn_tmp, 'r') as tf:  # eliminate quotation mark if not compact mode
-                str_data = tf.readline() if is_compact(item_name) else tf.readline().replace('"', '')
-        except FileNotFoundError:
-            cj.handleFileNotFoundError(fn_tmp)
+    def encode_list(item_name, data_lst):
+        """Encoder stage: serialize the list to a JSON array string"""
+        # specify separators to remove spaces
+        str_data = json.dumps(data_lst, ensure_ascii=False, separators=(',', ':'))
+        # eliminate quotation mark if not compact mode
+        return str_data if is_compact(item_name) else str_data.replace('"', '')
 
+    def write_json(item_name, str_data, n_data, date_fr, date_to):
+        """Writer stage: output the JSON file with the meta data and report it"""
+        fn_json = cj.get_fullpath_json(loc_df, item_name, date_fr[:4])
         try:
-            # Output the JSON file with the meta data
             with open(fn_json, 'w') as jf:
                 jf.write(cj.json_meta_obj(loc_df, date_fr, date_to, \
                         get_compact_items() if is_compact(item_name) else item_name))
@@ -185,25 +183,68 @@ def jma_main(csv_name):
         except FileNotFoundError:
             cj.handleFileNotFoundError(fn_json)
 
-        # Cleanup
-        if os.path.exists(fn_tmp):
-            os.remove(fn_tmp)
-        else:
-            print(fn_tmp, ' - File not exist')
-
         sz_json = os.path.getsize(fn_json)    # ternary operator
         print(cj.Deco.rowIcon+pc.CBLUE if is_compact(item_name) else cj.Deco.colIcon+pc.CGREEN, \
               fn_json, pc.CEND, ' (', cj.file_size(sz_json), ') ', end='')
         if is_compact(item_name):
             days_year = 366 if calendar.isleap(int(date_fr[:4])) else 365
-            print(len(data_lst), 'days ', \
+            print(n_data, 'days ', \
                   cj.Deco.LeapYear if (days_year == 366) else cj.Deco.NoLeap,  \
                   cj.Deco.warning + pc.CRED + 'Incomplete data!' + pc.CEND \
-                  if (len(data_lst) != days_year) else '')
+                  if (n_data != days_year) else '')
         else:
-            print(cj.Deco.tabs, cj.get_years(len(data_lst)))
+            print(cj.Deco.tabs, cj.get_years(n_data))
         return sz_json
 
+    ''' Staged pipeline: parser (this thread) -> encoder -> writer (worker threads)
+    Each completed year is handed over as soon as '/1/1' starts the next one,
+    so the yearly compact files are written while parsing continues.
+    Bounded queues (PIPE_DEPTH) keep about one year of buffered compact data. '''
+    encode_q = queue.Queue(maxsize=PIPE_DEPTH)  # (item_name, data_lst, date_fr, date_to)
+    write_q  = queue.Queue(maxsize=PIPE_DEPTH)  # (item_name, str_data, n_data, date_fr, date_to)
+    sz_col_j = 0
+    sz_row_j = 0
+    errors   = []  # exceptions raised in the worker threads, re-raised after join
+
+    def encoder():
+        while True:
+            job = encode_q.get()
+            if job is None:       # end of the stream
+                write_q.put(None)
+                return
+            if errors:            # keep draining so that the parser never blocks
+                continue
+            item_name, data_lst, d_fr, d_to = job
+            try:
+                str_data = encode_list(item_name, data_lst)
+            except BaseException as e:
+                errors.append(e)
+                continue
+            write_q.put((item_name, str_data, len(data_lst), d_fr, d_to))
+
+    def writer():
+        nonlocal sz_col_j, sz_row_j
+        while True:
+            job = write_q.get()
+            if job is None:
+                return
+            if errors:
+                continue
+            try:
+                sz = write_json(*job)
+            except BaseException as e:
+                errors.append(e)
+                continue
+            if is_compact(job[0]):
+                sz_row_j += sz
+            else:
+                sz_col_j += sz
+
+    workers = [threading.Thread(target=encoder, daemon=True), \
+               threading.Thread(target=writer,  daemon=True)]
+    for w in workers:
+        w.start()
+
     # Read CSV file
     print(cj.Deco.csvIcon, ' Data Source:', pc.CBLACK+pc.CYELLOWBG, cj.PathName.csv + csv_name, pc.CEND)
     ###### Data store per column
@@ -211,20 +252,19 @@ def jma_main(csv_name):
     for c in range(len(col_x_lst)):
         col_data_lst.append([])
 
-    ###### Data store per date
-    row_data_lst = []  # two-dimmensional array (per year)
-
-    years_lst  = []  # 4 digit string of each year of the data
-    date_fr    = []  # from date of each year
-    date_to    = []  # to   date of each year
+    ###### Data store per date (current year only, completed years go to the pipeline)
+    row_data_lst = None
+    date_fr_all  = None  # from date of the whole data
+    date_fr      = None  # from date of the current year
+    date_to      = None  # to   date of the current year
     days_count = 0
     try:
         with open(cj.PathName.csv + csv_name, 'r', encoding='utf-8') as cf:
             in_data = csv.reader(cf, delimiter=',')
             ''' Process CSV data
             1. Save to col_data_lst[c] per column (i.e. per item) for each daily data
-            2. Save to row_data_lst[y] every column per day combining to a compact form, per year list '''
-            yrId = -1  # index for the yearly list
+            2. Save to row_data_lst every column per day combining to a compact form,
+               and hand it over to the pipeline when the year is completed '''
             for row in in_data:
                 if ('/' not in row[0]) or (not row[0][:4].isnumeric()):   # skip header part (that has no date)
                     continue
@@ -241,32 +281,31 @@ def jma_main(csv_name):
                     if val is not '':
                         s += val
                 if (days_count == 0) or (row[0].endswith('/1/1')):  # start date of the year
-                    row_data_lst.append([])   # initialize new rowData for the new year
-                    years_lst.append(row[0][:4])
-                    date_fr.append(row[0][:10])
-                    date_to.append(row[0][:10])
-                    yrId  += 1
-                    print(cj.Deco.yearIcon, years_lst[len(years_lst)-1], end='')  # print out the year
-                else:
-                    date_to[yrId] = row[0][:10]  # to save out of the loop, ex: 2018/12/20
-                row_data_lst[yrId].append(s)
+                    if row_data_lst is None:
+                        date_fr_all = row[0][:10]
+                    else:                     # emit the completed year, 'c' for compact format
+                        encode_q.put(('c', row_data_lst, date_fr, date_to))
+                    row_data_lst = []   # initialize new rowData for the new year
+                    date_fr = row[0][:10]
+                date_to = row[0][:10]   # to save out of the loop, ex: 2018/12/20
+                row_data_lst.append(s)
                 days_count += 1
     except UnicodeDecodeError:
         cj.handleCriticalError('UnicodeDecodeError')
-    print('->Total', days_count, 'days (', cj.get_years(days_count), ')')
+    if row_data_lst is not None:  # the last year, possibly incomplete
+        encode_q.put(('c', row_data_lst, date_fr, date_to))
 
-    sz_col_j = 0
-    sz_row_j = 0
-    ## Save column-wise data
+    ## Save column-wise data (available only after the whole file has been parsed)
     for col in range(len(col_x_lst)):
         if CI.cnt_list[col] > 0:
-            sz_col_j += WriteListJson(CI.name[col_x_lst[col]], col_data_lst[col], \
-                                      date_fr[0], date_to[len(years_lst)-1])
+            encode_q.put((CI.name[col_x_lst[col]], col_data_lst[col], date_fr_all, date_to))
+    encode_q.put(None)
+    for w in workers:
+        w.join()
+    if errors:
+        raise errors[0]
+    print(cj.Deco.yearIcon, '->Total', days_count, 'days (', cj.get_years(days_count), ')')
     print(cj.Deco.sizeHeadC, cj.file_size(sz_col_j), ' in total.')
-
-    ## Save yearly compact form data
-    for y in range(len(years_lst)):
-        sz_row_j += WriteListJson('c', row_data_lst[y], date_fr[y], date_to[y])  #'c' for compact format
     print(cj.Deco.sizeHeadR, cj.file_size(sz_row_j), ' in total. ', cj.Deco.success)
 
     return sz_col_j, sz_row_j, days_count   # construct a tuple